@@ -1,59 +1,84 @@
 import base64
-import io
+import hashlib
 import json
 import logging
+import os
+import queue
+import threading
 import time
+from concurrent.futures import Future
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
+from types import MappingProxyType
+from typing import Any, Dict, List, Tuple
 
 import dash_daq
+import flask
 import dash_mantine_components as dmc
+import itsdangerous
 import pandas as pd
+import plotly.graph_objects as go
 import plotly.io as pio
 import dash_mantine_components as dmc
-from dash import (ALL, MATCH, Input, Output, State, callback, ctx, dash_table,
-                  dcc, get_asset_url, html, no_update)
+from dash import (ALL, MATCH, Input, Output, Patch, State, callback,
+                  clientside_callback, ctx, dash_table, dcc, get_app,
+                  get_asset_url, html, no_update)
 from dash_iconify import DashIconify
 
 from . import DATA_PATH, DATASETS, exec
 
-__all__ = ["DataSetPicker", "HTMLTable", "NotebookStarter", "PueueLog", "TagList", "PathSelector", "PlotDownloadButton"]
+try:
+    import orjson
+
+    _dumps = lambda obj: orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _dumps = json.dumps
+
+__all__ = ["DataSetPicker", "HDataTable", "HTMLTable", "NotebookStarter", "PueueLog", "TagList", "PathSelector", "PlotDownloadButton"]
 logger = logging.getLogger("dhc")
 
 
+@lru_cache(maxsize=4096)
 def titelize(s: str) -> str:
     return s.replace("_", " ").replace("-", " ").title()
 
 
-__old_datatable_init = dash_table.DataTable.__init__
-__data_table_defaults = dict(
-    style_cell={
+_DEFAULT_STYLE_CELL = MappingProxyType(
+    {
         "whiteSpace": "normal",
         "height": "auto",
-    },
+    }
 )
 
 
-def __new_datatable_init(self, *args, **kwargs):
-    __old_datatable_init(self, *args, **{**__data_table_defaults, **kwargs})
+class HDataTable(dash_table.DataTable):
+    """A `dash_table.DataTable` that wraps its cell contents by default."""
 
-
-dash_table.DataTable.__init__ = __new_datatable_init
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("style_cell", dict(_DEFAULT_STYLE_CELL))
+        super().__init__(*args, **kwargs)
 
 
 class NotebookStarter:
     def __new__(_, name, parameters={}):
-        param_string = json.dumps(parameters)
-        id_ = f"{name}__{param_string}"
+        # the parameters live in a store, the id only carries a short digest to tell starters of one notebook apart
+        # sorted and with str fallback, so equal parameters in any order and with any key type get the same id
+        digest = hashlib.sha1(json.dumps(parameters, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:10]
+        id_ = f"{name}__{digest}"
 
-        return html.A(
-            dmc.Button(
-                "Generate notebook",
-                leftIcon=DashIconify(icon="logos:jupyter"),
-            ),
-            id={"module": "notebookstarter", "id": id_},
-            n_clicks=0,
-            target="_blank",
+        return html.Span(
+            [
+                html.A(
+                    dmc.Button(
+                        "Generate notebook",
+                        leftIcon=DashIconify(icon="logos:jupyter"),
+                    ),
+                    id={"module": "notebookstarter", "id": id_},
+                    n_clicks=0,
+                    target="_blank",
+                ),
+                dcc.Store(id={"module": "notebookstarter", "attr": "parameters", "id": id_}, data={"name": name, "parameters": parameters}),
+            ]
         )
 
 
@@ -61,16 +86,13 @@ class NotebookStarter:
     Output({"module": "notebookstarter", "id": MATCH}, "children"),
     Output({"module": "notebookstarter", "id": MATCH}, "href"),
     Input({"module": "notebookstarter", "id": MATCH}, "n_clicks"),
-    State({"module": "notebookstarter", "id": MATCH}, "id"),
+    State({"module": "notebookstarter", "attr": "parameters", "id": MATCH}, "data"),
     State({"module": "notebookstarter", "id": MATCH}, "className"),
 )
-def __create_notebook(n_clicks, id_, className):
+def __create_notebook(n_clicks, notebook, className):
     if ctx.triggered_id is None or n_clicks == 0 or "activated" in className:
         return no_update
-    id_ = id_["id"]
-    name = id_.split("__")[0]
-    parameters = json.loads(id_[len(name) + 2 :])
-    link = exec.start_notebook(name, parameters)
+    link = exec.start_notebook(notebook["name"], notebook["parameters"])
 
     return (
         dmc.Button("Open notebook", leftIcon=DashIconify(icon="logos:jupyter"), color="lime"),
@@ -78,6 +100,25 @@ def __create_notebook(n_clicks, id_, className):
     )
 
 
+def _dataset_options(datasets: Dict[str, List[str]]) -> Tuple[List[Dict[str, str]], Dict[str, List[Dict[str, str]]]]:
+    folder_options = [{"label": folder, "value": folder} for folder in datasets.keys()]
+    file_options = {folder: [{"label": f, "value": f"{folder}/{f}"} for f in files] for folder, files in datasets.items()}
+    return folder_options, file_options
+
+
+# DATASETS is loaded once at import, so the dropdown options of the pickers are constants as well
+_FOLDER_OPTIONS, _FILE_OPTIONS = _dataset_options(DATASETS)
+
+
+@lru_cache(maxsize=1024)
+def _resolve_key(value: str) -> Tuple[bool, str]:
+    """Whether the anndata_cache key of `value` is a cached dataset, and its name. Clear with `_resolve_key.cache_clear()`."""
+    import anndata_cache
+
+    key = anndata_cache.Key(value)
+    return key.location == anndata_cache.CacheLocation.CACHED, key.name
+
+
 class DataSetPicker:
     @staticmethod
     def _absolute_layout(id_, value=None):
@@ -87,16 +128,18 @@ class DataSetPicker:
                 id={"module": "datasetpicker", "attr": "switch", "id": id_},
                 variant="subtle"
             ),
-            dmc.TextInput(id={"module": "datasetpicker", "attr": "file", "id": id_}, value=value,
+            dmc.TextInput(id={"module": "datasetpicker", "attr": "file", "id": id_}, value=value, debounce=300,
                             label="Path", description="Enter an absolute path to the AnnData", placeholder="Enter a path"
                           ),
+            # placeholder, so that the folder input of the picker callback exists in both layouts
+            dcc.Input(id={"module": "datasetpicker", "attr": "folder", "id": id_}, type="hidden"),
         ]
 
     @staticmethod
     def _list_layout(id_, folder=None, file=None):
         options, value = [], None
-        if folder is not None and folder in DATASETS:
-            options = [{"label": f, "value": f"{folder}/{f}"} for f in DATASETS[folder]]
+        if folder is not None and folder in _FILE_OPTIONS:
+            options = _FILE_OPTIONS[folder]
             if file is not None:
                 value = f"{folder}/{file}"
 
@@ -110,7 +153,7 @@ class DataSetPicker:
                 [
                             dmc.Select(
                                 id={"module": "datasetpicker", "attr": "folder", "id": id_},
-                                data=[{"label": value, "value": value} for value in DATASETS.keys()],
+                                data=_FOLDER_OPTIONS,
                                 value=folder,
                                 label="Folder",
                                 description="Select a folder", 
@@ -132,20 +175,19 @@ class DataSetPicker:
         if value is None or value == "" or value == "None":
             form = DataSetPicker._list_layout(id_)
         else:
-            import anndata_cache
-
-            key = anndata_cache.Key(value)
-            if key.location == anndata_cache.CacheLocation.CACHED:
-                folder, file = key.name.split("/")
+            is_cached, name = _resolve_key(value)
+            if is_cached:
+                folder, file = name.split("/")
                 form = DataSetPicker._list_layout(id_, folder, file)
             else:
-                form = DataSetPicker._absolute_layout(id_, key.name)
+                form = DataSetPicker._absolute_layout(id_, name)
         return html.Fieldset(
             [
                 html.Legend(titelize(id_)),
                 dmc.Stack(form, id={"module": "datasetpicker", "attr": "container", "id": id_}, align="end", spacing="0"),
                 html.Span(className="errorbox", id={"module": "datasetpicker", "attr": "error", "id": id_}),
                 dcc.Input(id={"module": "datasetpicker", "id": id_}, type="hidden", value=value),
+                dcc.Store(id={"module": "datasetpicker", "attr": "check", "id": id_}),
             ],
             style=style,
         )
@@ -154,40 +196,78 @@ class DataSetPicker:
 @callback(
     Output({"module": "datasetpicker", "attr": "container", "id": MATCH}, "children"),
     Input({"module": "datasetpicker", "attr": "switch", "id": MATCH}, "n_clicks"),
-    State({"module": "datasetpicker", "attr": "switch", "id": MATCH}, "id"),
+    Input({"module": "datasetpicker", "attr": "folder", "id": MATCH}, "value"),
     State({"module": "datasetpicker", "attr": "switch", "id": MATCH}, "children"),
 )
-def __datasetpicker_switch_layout_callback(n_clicks, id_, button_text):
-    if n_clicks is None:
-        return no_update
-    if button_text == "From list":
-        return DataSetPicker._list_layout(id_["id"])
-    else:
-        return DataSetPicker._absolute_layout(id_["id"])
+def __datasetpicker_callback(n_clicks, folder, button_text):
+    attr = ctx.triggered_id["attr"] if ctx.triggered_id else None
 
-
-@callback(
-    Output({"module": "datasetpicker", "attr": "file", "id": MATCH}, "data"),
-    Input({"module": "datasetpicker", "attr": "folder", "id": MATCH}, "value"),
-    prevent_initial_call=True,
+    # switch between the list and the absolute path layout
+    if attr == "switch":
+        if n_clicks is None:
+            return no_update
+        if button_text == "From list":
+            return DataSetPicker._list_layout(ctx.triggered_id["id"])
+        else:
+            return DataSetPicker._absolute_layout(ctx.triggered_id["id"])
+
+    # a folder got selected, only swap the options of the file dropdown
+    if attr == "folder" and folder is not None:
+        container = Patch()
+        container[1]["props"]["children"][1]["props"]["data"] = _FILE_OPTIONS[folder]
+        return container
+    return no_update
+
+
+# Files of the known datasets are validated in the browser, only other paths are handed to the server via the check store.
+clientside_callback(
+    """
+    (function () {
+        const known = new Set(%s);
+        return function (file) {
+            const no_update = window.dash_clientside.no_update;
+            if (!file) {
+                return ["", no_update, no_update];
+            }
+            if (known.has(file)) {
+                return ["", file, no_update];
+            }
+            return [no_update, no_update, file];
+        };
+    })()
+    """
+    % _dumps([option["value"] for options in _FILE_OPTIONS.values() for option in options]),
+    Output({"module": "datasetpicker", "attr": "error", "id": MATCH}, "children"),
+    Output({"module": "datasetpicker", "id": MATCH}, "value"),
+    Output({"module": "datasetpicker", "attr": "check", "id": MATCH}, "data"),
+    Input({"module": "datasetpicker", "attr": "file", "id": MATCH}, "value"),
 )
-def __datasetpicker_folder_file_dropdown_callback(folder):
-    if folder is None:
-        return no_update
-    return [{"label": f, "value": f"{folder}/{f}"} for f in DATASETS[folder]]
+
+
+def _datasetpicker_path_error(file: str) -> str:
+    # not cached, files come and go while the app runs, the input debounce already keeps the stats rare
+    if not Path(file).exists() and not (Path(DATA_PATH) / (file + ".h5ad")).exists():
+        return "does not exist"
+    return ""
 
 
 @callback(
-    Output({"module": "datasetpicker", "attr": "error", "id": MATCH}, "children"),
-    Output({"module": "datasetpicker", "id": MATCH}, "value"),
-    Input({"module": "datasetpicker", "attr": "file", "id": MATCH}, "value"),
+    Output({"module": "datasetpicker", "attr": "error", "id": MATCH}, "children", allow_duplicate=True),
+    Output({"module": "datasetpicker", "id": MATCH}, "value", allow_duplicate=True),
+    Input({"module": "datasetpicker", "attr": "check", "id": MATCH}, "data"),
+    State({"module": "datasetpicker", "attr": "error", "id": MATCH}, "children"),
+    State({"module": "datasetpicker", "id": MATCH}, "value"),
+    prevent_initial_call=True,
 )
-def __datasetpicker_file_not_exists_error_callback(file):
+def __datasetpicker_file_not_exists_error_callback(file, current_error, current_value):
     if file is None:
-        return "", no_update
-    if not Path(file).exists() and not (Path(DATA_PATH) / (file + ".h5ad")).exists():
-        return f"does not exist", no_update
-    return "", file
+        return no_update
+    error = _datasetpicker_path_error(file)
+    value = no_update if error else file
+    # nothing changed for the user, don't re-render
+    if error == current_error and (error or value == current_value):
+        return no_update
+    return error, value
 
 
 class HTMLTable:
@@ -208,6 +288,15 @@ class HTMLTable:
         else:
             return value
 
+    @staticmethod
+    def _values(column: pd.Series) -> list:
+        if pd.api.types.is_float_dtype(column.dtype):
+            return [f"{value:.4f}" for value in column.tolist()]
+        elif column.dtype == object:
+            return [HTMLTable._value(value) for value in column.tolist()]
+        else:
+            return column.tolist()
+
     @staticmethod
     def from_dict(data: dict, titelized: bool = False, columns: List[str] = None, tr_kwargs: dict = None):
         data = pd.DataFrame({"index": list(data.keys()), "value": list(data.values())})
@@ -224,22 +313,89 @@ class HTMLTable:
         if header:
             table.append(html.Thead(html.Tr([html.Th(c) for c in data.columns])))
         tbody = []
-        for row_values in data.values:
-            idx = row_values[0]
-            row = [html.Td(titelize(idx) if titelized else idx)]
-            for value in row_values[1:]:
-                row.append(html.Td(HTMLTable._value(value)))
+        if data.shape[1] == 0:
+            table.append(html.Tbody(tbody))
+            return dmc.Table(table, style=style)
+        # format column-wise, so mixed dtypes are never boxed into one object array
+        columns = [data.iloc[:, 0].tolist()] + [HTMLTable._values(column) for _, column in data.iloc[:, 1:].items()]
+        index = columns[0]
+        labels = [titelize(idx) for idx in index] if titelized else index
+        for idx, label, *row_values in zip(index, labels, *columns[1:]):
+            row = [html.Td(label)]
+            row.extend(html.Td(value) for value in row_values)
             tbody.append(html.Tr(row, **tr_kwargs.get(idx, {})))
         table.append(html.Tbody(tbody))
         return dmc.Table(table, style=style)
 
 
+class _StatusBatcher:
+    """Coalesces the status polls of all live `PueueLog`s into one `exec.statuses` call per batch window."""
+
+    max_wait_ms = 200
+    max_batch = 64
+    timeout = 30  # seconds a status call may take before the waiting callbacks fail
+
+    __queue = queue.Queue()
+    __worker = None
+    __lock = threading.Lock()
+
+    @staticmethod
+    def get(task_id: str, full: bool = False) -> Dict[str, Any]:
+        future = Future()
+        _StatusBatcher.__queue.put((int(task_id), full, future))
+        with _StatusBatcher.__lock:
+            if _StatusBatcher.__worker is None:
+                _StatusBatcher.__worker = threading.Thread(target=_StatusBatcher.__run, name="dhc-status-batcher", daemon=True)
+                _StatusBatcher.__worker.start()
+        # raises a TimeoutError into the callback instead of holding the flask worker forever
+        return future.result(timeout=_StatusBatcher.timeout + _StatusBatcher.max_wait_ms / 1000)
+
+    @staticmethod
+    def __run():
+        while True:
+            batch = [_StatusBatcher.__queue.get()]
+            deadline = time.monotonic() + _StatusBatcher.max_wait_ms / 1000
+            while len(batch) < _StatusBatcher.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(_StatusBatcher.__queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # fetch each batch on its own thread, so a slow pueue call doesn't hold up the following batches
+            for full in {full for _, full, _ in batch}:
+                requests = [(task_id, future) for task_id, full_, future in batch if full_ == full]
+                threading.Thread(target=_StatusBatcher.__fetch, args=(requests, full), name="dhc-status-fetch", daemon=True).start()
+
+    @staticmethod
+    def __fetch(requests: List[Tuple[int, Future]], full: bool):
+        try:
+            statuses = exec.statuses(sorted({task_id for task_id, _ in requests}), full=full, timeout=_StatusBatcher.timeout)
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+        for task_id, future in requests:
+            if task_id in statuses:
+                # every waiter gets its own copy, callers annotate the dict
+                future.set_result(dict(statuses[task_id]))
+            else:
+                future.set_exception(KeyError(f"Task {task_id} not found"))
+
+
 class PueueLog:
     __registered_callbacks = set()
+    __warned = set()
+    __terminal_states = {"Finished", "Failed", "Killed", "Success"}
+    __log_index = 3  # position of the log markdown in the status ui
+    _POLL_INTERVAL_MS = 5000
 
     def __new__(_, id: str, task_id: str = None, is_live: bool = False, full: bool = False):
-        if not id in PueueLog.__registered_callbacks:
-            logger.warn("PueueLog callback not registered. Please, execute dhc.PueueLog.register_callbacks(id_) somewhere in the main app.")
+        if id not in PueueLog.__registered_callbacks and id not in PueueLog.__warned:
+            PueueLog.__warned.add(id)
+            logger.warning("PueueLog callback for %s not registered. Please, execute dhc.PueueLog.register_callbacks(id_) somewhere in the main app.", id)
         return html.Section(
             [
                 html.H2(id=f"{id}_title"),
@@ -264,6 +420,8 @@ class PueueLog:
                     className="columns",
                 ),
                 html.Div("Loading...", id=f"{id}_log"),
+                dcc.Interval(id=f"{id}_tick", interval=PueueLog._POLL_INTERVAL_MS, disabled=not is_live),
+                dcc.Store(id=f"{id}_hash"),
             ],
             id=f"{id}_container",
         )
@@ -290,27 +448,23 @@ class PueueLog:
                 Output(f"{id}_title", "children"),
                 Output(f"{id}_log", "children"),
                 Output(f"{id}_container", "className"),
+                Output(f"{id}_tick", "disabled"),
+                Output(f"{id}_hash", "data"),
             ],
             inputs=[
                 Input(id, "value"),
                 Input(f"{id}_live", "on"),
                 Input(f"{id}_full", "on"),
+                Input(f"{id}_tick", "n_intervals"),
             ],
-            background=True,
-            progress=[
-                Output(f"{id}_title", "children"),
-                Output(f"{id}_log", "children"),
-            ],
-            running=[(Output(f"{id}_container", "className"), "progressing", "hidden")],
-            cancel=[Input(f"{id}_live", "on")],
-            interval=1000,  # Time between each call to the function
+            state=[State(f"{id}_hash", "data")],
         )(PueueLog.__pueue_status_callback)
 
     @staticmethod
     def __pueue_queue_again_callback(_, task_id: str):
         if ctx.triggered_id is None:
             return no_update
-        status = exec.status(task_id)
+        status = _StatusBatcher.get(task_id)
         command = status["command"]
         group = status["group"]
 
@@ -323,14 +477,18 @@ class PueueLog:
         if ctx.triggered_id is None:
             return no_update
         logger.info(f"Killing task {task_id}.")
-        exec.execute(f"./pueue kill {task_id}")
+        exec.kill(task_id)
         return True
 
     @staticmethod
     def __pueue_status(task_id: str, full: bool = False):
-        status = exec.status(task_id, full=full)
+        status = _StatusBatcher.get(task_id, full=full)
+        status["hash"] = exec.status_hash({k: v for k, v in status.items() if k != "log"})
+        return status
 
-        status["ui"] = [
+    @staticmethod
+    def __pueue_status_ui(task_id: str, status: Dict[str, Any]):
+        return [
             html.Div(
                 [
                     html.Div([html.P("Status"), html.Span(status["status"], className=f"tag {status['status'].lower()}")]),
@@ -354,24 +512,39 @@ class PueueLog:
             ),
             dcc.Markdown(f"```csharp\n{status['log']}"),
         ]
-        return status
 
     @staticmethod
-    def __pueue_status_callback(set_progress, task_id: str, is_live: bool, full: bool):
+    def __pueue_status_callback(task_id: str, is_live: bool, full: bool, _, last: Dict[str, Any]):
         if task_id is None or task_id == "" or is_live is None or full is None:
             return no_update
 
-        if not is_live:
-            status_ = PueueLog.__pueue_status(task_id, full=full)
+        status_ = PueueLog.__pueue_status(task_id, full=full)
+        # keep ticking only while the task can still change
+        polling = is_live and status_["status"] not in PueueLog.__terminal_states
+        if polling:
+            title, className = f"Task {status_['id']} @ {status_['group']}...", "progressing"
         else:
-            while True:
-                status_ = PueueLog.__pueue_status(task_id, full=full)
-                if status_["status"] in {"Finished", "Failed", "Killed", "Success"}:
-                    break
-                set_progress((f"Task {status_['id']} @ {status_['group']}...", status_["ui"]))
-                time.sleep(5)
-
-        return f"Task {status_['id']} @{ status_['group']}", status_["ui"], ""
+            title, className = f"Task {status_['id']} @ {status_['group']}", ""
+
+        log = status_["log"]
+        fingerprint = {"hash": status_["hash"], "log_length": len(log), "log_hash": exec.status_hash({"log": log})}
+
+        # the status itself changed, render everything
+        if last is None or last["hash"] != status_["hash"]:
+            return title, PueueLog.__pueue_status_ui(task_id, status_), className, not polling, fingerprint
+        # the log did not change since the last tick, skip re-sending the whole tree
+        if last["log_hash"] == fingerprint["log_hash"]:
+            return title, no_update, className, not polling, no_update
+
+        # only the log changed, patch the log markdown and leave the rest of the ui as is
+        ui = Patch()
+        previous_length = last["log_length"]
+        if full and len(log) >= previous_length and exec.status_hash({"log": log[:previous_length]}) == last["log_hash"]:
+            # the full log only grew, send just the new tail
+            ui[PueueLog.__log_index]["props"]["children"] += log[previous_length:]
+        else:
+            ui[PueueLog.__log_index]["props"]["children"] = f"```csharp\n{log}"
+        return title, ui, className, not polling, fingerprint
 
 
 class TagList:
@@ -381,8 +554,8 @@ class TagList:
         if options is None:
             options = []
 
-        options = [t for t in tags if t not in options] + options
-        options = [{"label": t, "value": t} for t in options]
+        known = set(options)
+        options = [{"label": t, "value": t} for t in [t for t in tags if t not in known] + options]
 
         return html.Div(
             [
@@ -406,17 +579,31 @@ class TagList:
 def taglist_add_tag(value: str, tags: List[Dict[str, str]], value_: List[str]):
     if ctx.triggered_id is None or value is None or value == "":
         return no_update
-    if value in [t["value"] for t in tags]:
+    if value in {t["value"] for t in tags}:
         return no_update
     if value_ is None:
         value_ = []
     return tags + [{"label": value, "value": value}], value_ + [value]
 
 
+def _pathselector_ls(target: Path, show_hidden: bool) -> Tuple[List[str], List[str]]:
+    # a single scan, DirEntry caches the file type so is_dir/is_file don't stat again
+    with os.scandir(target) as it:
+        entries = sorted((e for e in it if show_hidden or not e.name.startswith(".")), key=lambda e: e.name)
+    return [e.name for e in entries if e.is_dir()], [e.name for e in entries if e.is_file()]
+
+
 class PathSelector:
+    __signer = None  # signs the root folder carried by each selector, set by register_route
+    __modes = {"FV", "FH", "DV", "DH"}
+
     def __new__(_, id_: str, root_folder: Path, only_folders: bool = False, show_hidden: bool = False):
         # mode contains only_folders and show_hidden
         mode = ("D" if only_folders else "F") + ("H" if show_hidden else "V")
+        if PathSelector.__signer is None:
+            raise RuntimeError("PathSelector route not registered. Please, execute dhc.PathSelector.register_route(app) when setting up the app.")
+        # the listing route only lists below this root, signed so the browser can't swap it for another folder
+        root = PathSelector.__signer.dumps(str(Path(root_folder).expanduser().resolve()))
         return html.Div(
             [
                 dcc.Input(id={"module": "pathselector", "id": f"{id_}"}, style={"margin-bottom": "0"}),
@@ -424,6 +611,7 @@ class PathSelector:
                 html.Div(
                     [
                         html.Div(mode, id={"module": "pathselector", "id": f"{id_}", "attr": "mode"}, style={"display": "none"}),
+                        html.Div(root, id={"module": "pathselector", "id": f"{id_}", "attr": "root"}, style={"display": "none"}),
                         html.Ul(id={"module": "pathselector", "id": f"{id_}", "attr": "list"}),
                         html.Div(
                             [
@@ -444,6 +632,53 @@ class PathSelector:
             ]
         )
 
+    @staticmethod
+    def register_route(app):
+        """Registers the JSON listing route the path browser fetches from, on the flask server of `app`. Call it once
+        when setting up the app, before any `PathSelector` is created and before the app serves requests.
+
+        The root folders are signed with the flask `secret_key` of the app. Set it when running several workers,
+        otherwise every process signs with its own random key.
+        """
+        if PathSelector.__signer is not None:
+            return
+        logger.debug("Registering route for PathSelector")
+        secret_key = app.server.secret_key
+        if not secret_key:
+            logger.warning("The flask app has no secret_key, PathSelector roots are signed with a random per-process key.")
+            secret_key = os.urandom(32)
+        app.server.add_url_rule(f"{app.config.routes_pathname_prefix}_dhc/ls", "dhc_pathselector_ls", PathSelector.__ls_route)
+        PathSelector.__signer = itsdangerous.URLSafeSerializer(secret_key, salt="dhc-pathselector")
+
+    @staticmethod
+    def __ls_route():
+        args = flask.request.args
+        try:
+            root = Path(PathSelector.__signer.loads(args.get("root", "")))
+        except itsdangerous.BadData:
+            flask.abort(403)
+        mode = args.get("mode", "FV")
+        if mode not in PathSelector.__modes:
+            flask.abort(400)
+        show_hidden = mode[1] == "H"
+
+        current_folder = Path(args.get("path", str(root))).expanduser().resolve()
+        goto = args.get("goto")
+        if goto == "..":
+            # going up from the root stays at the root
+            target = current_folder.parent if current_folder != root else root
+        elif goto:
+            target = (current_folder / goto).resolve()
+        else:
+            target = current_folder
+        if not target.is_relative_to(root):
+            flask.abort(403)
+
+        if not target.is_dir():
+            return flask.jsonify({"path": str(target), "folders": None, "files": None})
+        folders, files = _pathselector_ls(target, show_hidden)
+        return flask.jsonify({"path": str(target), "folders": folders, "files": files})
+
 
 @callback(
     Output({"module": "pathselector", "id": MATCH, "attr": "modal"}, "hidden"),
@@ -461,57 +696,119 @@ def __pathselector_open_close_callback(_, __, current_folder):
     return no_update, no_update
 
 
+# Only renders the root folder, navigating is done by the clientside callback below
 @callback(
-    Output({"module": "pathselector", "id": MATCH, "attr": "current_folder"}, "children"),
     Output({"module": "pathselector", "id": MATCH, "attr": "list"}, "children"),
-    Input({"module": "pathselector", "id": MATCH, "goto": ALL}, "n_clicks"),
+    Input({"module": "pathselector", "id": MATCH, "attr": "mode"}, "children"),
     State({"module": "pathselector", "id": MATCH, "attr": "current_folder"}, "children"),
-    State({"module": "pathselector", "id": MATCH, "attr": "mode"}, "children"),
 )
-def __pathselector_click_callback(_, current_folder, mode):
+def __pathselector_initial_callback(mode, current_folder):
     only_folders = mode[0] == "D"
     show_hidden = mode[1] == "H"
-    current_folder = Path(current_folder)
+    target = Path(current_folder)
+    if not target.is_dir():
+        return no_update
 
-    if ctx.triggered_id:
-        clicked_elem = ctx.triggered_id["goto"]
+    id_ = ctx.args_grouping[-1]["id"]["id"]
+    folders, files = _pathselector_ls(target, show_hidden)
 
-        if clicked_elem == "..":
-            target = current_folder.parent
-        else:
-            target = current_folder / clicked_elem
+    list_elements = [html.Li("📁 ..", id={"module": "pathselector", "id": id_, "goto": ".."})]
+    list_elements.extend([html.Li(f"📁 {name}", id={"module": "pathselector", "id": id_, "goto": name}) for name in folders])
+    if only_folders:
+        list_elements.extend([html.Li(f"📄 {name}", className="static") for name in files])
     else:
-        target = current_folder
+        list_elements.extend([html.Li(f"📄 {name}", id={"module": "pathselector", "id": id_, "goto": name}) for name in files])
+    return list_elements
+
+
+clientside_callback(
+    """
+    async function (clicks, current_folder, mode, root) {
+        const no_update = window.dash_clientside.no_update;
+        const triggered = window.dash_clientside.callback_context.triggered;
+        if (!triggered.length || !triggered[0].value) {
+            return [no_update, no_update];
+        }
+        const prop_id = triggered[0].prop_id;
+        const clicked = JSON.parse(prop_id.slice(0, prop_id.lastIndexOf(".")));
+
+        const config = JSON.parse(document.getElementById("_dash-config").textContent);
+        const query = new URLSearchParams({root: root, path: current_folder, goto: clicked.goto, mode: mode});
+        const response = await fetch(`${config.requests_pathname_prefix}_dhc/ls?${query}`);
+        if (!response.ok) {
+            return [no_update, no_update];
+        }
+        const listing = await response.json();
+        if (listing.folders === null) {
+            return [listing.path, no_update];
+        }
+
+        const li = (label, goto) => ({
+            namespace: "dash_html_components",
+            type: "Li",
+            props: goto === null
+                ? {children: label, className: "static"}
+                : {children: label, id: {module: "pathselector", id: clicked.id, goto: goto}},
+        });
+        const only_folders = mode[0] === "D";
+        return [
+            listing.path,
+            [
+                li("📁 ..", ".."),
+                ...listing.folders.map((name) => li(`📁 ${name}`, name)),
+                ...listing.files.map((name) => li(`📄 ${name}`, only_folders ? null : name)),
+            ],
+        ];
+    }
+    """,
+    Output({"module": "pathselector", "id": MATCH, "attr": "current_folder"}, "children"),
+    Output({"module": "pathselector", "id": MATCH, "attr": "list"}, "children", allow_duplicate=True),
+    Input({"module": "pathselector", "id": MATCH, "goto": ALL}, "n_clicks"),
+    State({"module": "pathselector", "id": MATCH, "attr": "current_folder"}, "children"),
+    State({"module": "pathselector", "id": MATCH, "attr": "mode"}, "children"),
+    State({"module": "pathselector", "id": MATCH, "attr": "root"}, "children"),
+    prevent_initial_call=True,
+)
 
-    if target.is_dir():
-        id_ = ctx.args_grouping[-1]["id"]["id"]
 
-        list_elements = [html.Li("📁 ..", id={"module": "pathselector", "id": id_, "goto": ".."})]
-        folders = sorted([f for f in target.iterdir() if f.is_dir()], key=lambda f: f.name)
-        list_elements.extend(
-            [
-                html.Li(f"📁 {path.name}", id={"module": "pathselector", "id": id_, "goto": path.name})
-                for path in folders
-                if show_hidden or not path.stem.startswith(".")
-            ]
-        )
-        files = sorted([f for f in target.iterdir() if f.is_file()], key=lambda f: f.name)
-        if only_folders:
-            list_elements.extend(
-                [html.Li(f"📄 {path.name}", className="static") for path in files if show_hidden or not path.stem.startswith(".")]
-            )
-        else:
-            list_elements.extend(
-                [
-                    html.Li(f"📄 {path.name}", id={"module": "pathselector", "id": id_, "goto": path.name})
-                    for path in files
-                    if show_hidden or not path.stem.startswith(".")
-                ]
-            )
+_pdf_export_ready = threading.Event()
+_pdf_export_warmup = None
+_pdf_export_lock = threading.Lock()
+
+
+def _warmup_pdf_export():
+    """Starts (once per process) rendering a throw-away figure in the background. The first kaleido export of a process
+    has a MathJax watermark on the pdf.
+    ref: https://github.com/plotly/plotly.py/issues/3469#issuecomment-1081736804
+    """
+    global _pdf_export_warmup
 
-        return str(target), list_elements
+    def warmup():
+        try:
+            pio.full_figure_for_development(go.Figure(), warn=False)
+            time.sleep(2)
+        except Exception as e:
+            logger.warning(f"Warming up the PDF export failed: {e}")
+        finally:
+            _pdf_export_ready.set()
 
-    return str(target), no_update
+    with _pdf_export_lock:
+        if _pdf_export_warmup is None:
+            _pdf_export_warmup = threading.Thread(target=warmup, name="dhc-pdf-warmup", daemon=True)
+            _pdf_export_warmup.start()
+
+
+@lru_cache(maxsize=None)
+def _pdf_icon_src() -> str:
+    """The pdf icon as a data URI, so the buttons don't each fetch it from the assets."""
+    try:
+        for folder in [Path(__file__).parent / "assets", Path(get_app().config.assets_folder)]:
+            icon = folder / "icon-file-type-pdf.svg"
+            if icon.is_file():
+                return "data:image/svg+xml;base64," + base64.b64encode(icon.read_bytes()).decode("ascii")
+    except Exception as e:
+        logger.debug(f"Could not inline the pdf icon: {e}")
+    return get_asset_url("icon-file-type-pdf.svg")
 
 
 class PlotDownloadButton:
@@ -521,12 +818,14 @@ class PlotDownloadButton:
             assert id["type"] == "plot"
         else:
             graph_id = id
+        _warmup_pdf_export()
 
         return html.A(
             [
-                html.Img(src=get_asset_url("icon-file-type-pdf.svg")),
+                html.Img(src=_pdf_icon_src()),
                 button_text,
                 dcc.Download(id={"module": "plotdownloadbutton", "id": graph_id, "attr": "download"}),
+                dcc.Store(id={"module": "plotdownloadbutton", "id": graph_id, "attr": "request"}),
                 dcc.Store(
                     id={"module": "plotdownloadbutton", "id": graph_id, "attr": "config"},
                     data={
@@ -543,46 +842,48 @@ class PlotDownloadButton:
         )
 
 
-@callback(
-    Output({"module": "plotdownloadbutton", "id": MATCH, "attr": "download"}, "data"),
+# Resolving the export size and filename is done in the browser, the server only renders the PDF.
+clientside_callback(
+    """
+    function (n_clicks, fig, config, id) {
+        const layout = (fig && fig.layout) || {};
+        let filename = config.filename || `export_${id.id}.pdf`;
+        if (!filename.endsWith(".pdf")) {
+            filename += ".pdf";
+        }
+        return {
+            n_clicks: n_clicks,
+            filename: filename,
+            width: config.width ?? layout.width ?? 700,
+            height: config.height ?? layout.height ?? 500,
+        };
+    }
+    """,
+    Output({"module": "plotdownloadbutton", "id": MATCH, "attr": "request"}, "data"),
     Input({"module": "plotdownloadbutton", "id": MATCH}, "n_clicks"),
     State({"type": "graph", "id": MATCH}, "figure"),
     State({"module": "plotdownloadbutton", "id": MATCH, "attr": "config"}, "data"),
     State({"module": "plotdownloadbutton", "id": MATCH}, "id"),
     prevent_initial_call=True,
 )
-def __plotdownloadbutton_callback(_, fig, config, id_):
-    default_width, default_height = 700, 500
-    width = config["width"] if "width" in config and config["width"] is not None else fig.get("layout", {}).get("width", default_width)
-    height = (
-        config["height"] if "height" in config and config["height"] is not None else fig.get("layout", {}).get("height", default_height)
-    )
+
+
+@callback(
+    Output({"module": "plotdownloadbutton", "id": MATCH, "attr": "download"}, "data"),
+    Input({"module": "plotdownloadbutton", "id": MATCH, "attr": "request"}, "data"),
+    State({"type": "graph", "id": MATCH}, "figure"),
+    prevent_initial_call=True,
+)
+def __plotdownloadbutton_callback(request, fig):
+    width, height, filename = request["width"], request["height"], request["filename"]
 
     # this is a bug-fix, otherwise there is watermark with mathjax on the pdf
-    # ref: https://github.com/plotly/plotly.py/issues/3469#issuecomment-1081736804
-    fig = pio.full_figure_for_development(fig, warn=False)
-    time.sleep(2)
-
-    # In-memory File
-    temp_file = io.BytesIO()
-    # Write PDF to in-memory file
-    fig.write_image(temp_file, format="pdf", width=width, height=height, engine="kaleido")
-    # Reset file pointer to start
-    temp_file.seek(0)
-    # Encode file to base64 (string)
-    b64_data = base64.b64encode(temp_file.read()).decode()
-
-    if "filename" in config and config["filename"] is not None:
-        filename = config["filename"]
-    else:
-        filename = f"export_{id_['id']}.pdf"
-    if not filename.endswith(".pdf"):
-        filename += ".pdf"
-
-    # Download the binary data but tell the browser it's a PDF
-    return dict(
-        content=b64_data,
-        filename=filename,
+    _warmup_pdf_export()
+    _pdf_export_ready.wait()
+
+    # Write the PDF straight into the buffer dash encodes, and tell the browser it's a PDF
+    return dcc.send_bytes(
+        lambda buffer: pio.write_image(fig, buffer, format="pdf", width=width, height=height, engine="kaleido"),
+        filename,
         type="application/pdf",
-        base64=True,
     )
@@ -1,16 +1,35 @@
+import atexit
 import base64
+import codecs
 import datetime
+import hashlib
 import json
 import logging
 import os
-import string
+import re
+import select
+import socket
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Tuple, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Tuple, Union
 
-import paramiko
 import yaml
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# the libyaml emitter when PyYAML was built with it, same output as the pure python one
+_YAMLDumper = getattr(yaml, "CDumper", yaml.Dumper)
+
 ENV = {
     "KNOWN_HOSTS": "~/.ssh/known_hosts",
     "PUBKEY": "~/.ssh/id_ed25519.pub",
@@ -22,23 +41,173 @@ ENV = {
     "JUPYTER_KERNEL_NAME": "python3",
     "WORKER_HOST": "192.168.0.94",
     "WORKER_USER": "task_runner",
+    "SSH_POOL_SIZE": "8",
+    "SSH_SESSIONS_PER_CONN": "8",
 }
 
 for key, value in ENV.items():
     if f"DHC_{key}" in os.environ:
         ENV[key] = os.environ[f"DHC_{key}"]
 
+# the settings are fixed after import, resolve them once instead of on every call
+_KNOWN_HOSTS_PATH = str(Path(ENV["KNOWN_HOSTS"]).expanduser())
+_PUBKEY_PATH = str(Path(ENV["PUBKEY"]).expanduser())
+_DEFAULT_HOST = ENV["WORKER_HOST"]
+_DEFAULT_USER = ENV["WORKER_USER"]
+_SSH_POOL_SIZE = int(ENV["SSH_POOL_SIZE"])
+_SSH_SESSIONS_PER_CONN = int(ENV["SSH_SESSIONS_PER_CONN"])
+_JUPYTER_HOST = ENV["JUPYTER_HOST"]
+_JUPYTER_USER = ENV["JUPYTER_USER"]
+_JUPYTER_TEMPLATE_FOLDER = ENV["JUPYTER_TEMPLATE_FOLDER"]
+_JUPYTER_NOTEBOOK_FOLDER = ENV["JUPYTER_NOTEBOOK_FOLDER"]
+_JUPYTER_NOTEBOOK_URL = f"http://{ENV['JUPYTER_HOST']}:{ENV['JUPYTER_PORT']}/notebooks/generated/{{}}?kernel_name={ENV['JUPYTER_KERNEL_NAME']}"
+
 logger = logging.getLogger(__name__)
-if Path(ENV["KNOWN_HOSTS"]).expanduser().is_file():
-    SSH = paramiko.SSHClient()
-    SSH.load_host_keys(str(Path(ENV["KNOWN_HOSTS"]).expanduser()))
+
+if TYPE_CHECKING:
+    import paramiko
+
+
+@lru_cache(maxsize=None)
+def _get_ssh_module():
+    # paramiko and cryptography take a while to import, only pay for it once a connection is actually needed
+    import paramiko
+
+    return paramiko
+
+
+_ssh_pool: "OrderedDict[Tuple[str, str], paramiko.SSHClient]" = OrderedDict()
+_ssh_pool_lock = threading.Lock()
+# one lock per user@host, so a slow handshake only blocks the callers waiting for that same host
+_ssh_connect_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+def _pooled_conn(key: Tuple[str, str]) -> Union["paramiko.SSHClient", None]:
+    # must be called with _ssh_pool_lock held
+    conn = _ssh_pool.get(key)
+    if conn is None:
+        return None
+    transport = conn.get_transport()
+    if transport is not None and transport.is_active():
+        _ssh_pool.move_to_end(key)
+        return conn
+    logger.debug(f"Pooled SSH connection to {key[0]}@{key[1]} is dead, reconnecting")
+    conn.close()
+    del _ssh_pool[key]
+    return None
+
+
+def _get_conn(user: str, host: str) -> "paramiko.SSHClient":
+    """Returns a connected SSH client for user@host. Connections are kept open and reused while their transport is
+    active, the least recently used one is evicted once more than DHC_SSH_POOL_SIZE hosts are connected. Use
+    `_checkout` to run commands on it, which limits the number of concurrent sessions per connection and keeps an
+    evicted connection open until its last user is done.
+
+    Parameters
+    ----------
+    user : str
+        The username to use for the remote host
+    host : str
+        The hostname of the remote host
+
+    Returns
+    -------
+    paramiko.SSHClient
+        The connected client, owned by the pool. Don't close it.
+    """
+    key = (user, host)
+    with _ssh_pool_lock:
+        conn = _pooled_conn(key)
+        if conn is not None:
+            return conn
+        connect_lock = _ssh_connect_locks.setdefault(key, threading.Lock())
+
+    with connect_lock:
+        # another thread might have connected while we were waiting for the lock
+        with _ssh_pool_lock:
+            conn = _pooled_conn(key)
+            if conn is not None:
+                return conn
+
+        conn = _get_ssh_module().SSHClient()
+        if os.path.isfile(_KNOWN_HOSTS_PATH):
+            conn.load_host_keys(_KNOWN_HOSTS_PATH)
+        conn.connect(
+            host,
+            username=user,
+            key_filename=_PUBKEY_PATH,
+        )
+        conn.get_transport().set_keepalive(30)
+        # a transport multiplexes many sessions, but the SFTP channel is shared and must be used by one thread at a time
+        conn._dhc_sessions = threading.BoundedSemaphore(_SSH_SESSIONS_PER_CONN)
+        conn._dhc_sftp_lock = threading.Lock()
+        # checked out users, guarded by _ssh_pool_lock
+        conn._dhc_users = 0
+        conn._dhc_evicted = False
+
+        with _ssh_pool_lock:
+            _ssh_pool[key] = conn
+            while len(_ssh_pool) > _SSH_POOL_SIZE:
+                _, evicted = _ssh_pool.popitem(last=False)
+                evicted._dhc_evicted = True
+                # a connection still in use is closed by its last user in _checkout
+                if evicted._dhc_users == 0:
+                    evicted.close()
+        return conn
+
+
+@contextmanager
+def _checkout(user: str, host: str) -> Iterator["paramiko.SSHClient"]:
+    """Yields the pooled connection for user@host, while holding one of its DHC_SSH_SESSIONS_PER_CONN session slots.
+
+    Parameters
+    ----------
+    user : str
+        The username to use for the remote host
+    host : str
+        The hostname of the remote host
+
+    Yields
+    ------
+    paramiko.SSHClient
+        The connected client, owned by the pool. Don't close it.
+    """
+    while True:
+        conn = _get_conn(user, host)
+        with _ssh_pool_lock:
+            # it might have been evicted between _get_conn and here, then it's closed or about to be
+            if not conn._dhc_evicted:
+                conn._dhc_users += 1
+                break
+    try:
+        with conn._dhc_sessions:
+            yield conn
+    finally:
+        with _ssh_pool_lock:
+            conn._dhc_users -= 1
+            close = conn._dhc_evicted and conn._dhc_users == 0
+        if close:
+            conn.close()
+
+
+@atexit.register
+def _close_pool() -> None:
+    with _ssh_pool_lock:
+        while _ssh_pool:
+            _, conn = _ssh_pool.popitem()
+            conn.close()
 
 
 CMDType = Union[str, List[str], Tuple[str, Dict[str, Any]]]
 
 
+# characters the shell never interprets, strings made of only these don't need quoting
+_SHELL_SAFE_RE = re.compile(r"[A-Za-z0-9_\-./=:]+")
+
+
 def shell_escape(value: Any) -> str:
-    """Escapes a string for use in a shell command
+    """Escapes a string for use in a shell command. Numbers and strings without special characters are returned
+    unquoted.
 
     Parameters
     ----------
@@ -50,7 +219,12 @@ def shell_escape(value: Any) -> str:
     str
         The escaped string
     """
-    return "'" + str(value).replace(r"'", r"\''") + "'"
+    if isinstance(value, (int, float)):
+        return str(value)
+    value = str(value)
+    if _SHELL_SAFE_RE.fullmatch(value):
+        return value
+    return "'" + value.replace(r"'", r"\''") + "'"
 
 
 def resolve_cmd(cmd: CMDType) -> str:
@@ -67,6 +241,7 @@ def resolve_cmd(cmd: CMDType) -> str:
         The command as a string
     """
     if isinstance(cmd, str):
+        # already a command line, passed through untouched and never escaped again
         return cmd
     elif isinstance(cmd, list):
         return " ".join(cmd)
@@ -84,7 +259,16 @@ def resolve_cmd(cmd: CMDType) -> str:
         raise TypeError(f"Command must be of type str, list or dict, not {type(cmd)}")
 
 
-def cp(file: Path, dest: str, user: str = None, host: str = None) -> None:
+def _get_sftp(conn: "paramiko.SSHClient") -> "paramiko.SFTPClient":
+    # one SFTP channel per pooled connection, reopened if it got closed
+    sftp = getattr(conn, "_dhc_sftp", None)
+    if sftp is None or sftp.get_channel().closed:
+        sftp = conn._dhc_sftp = conn.open_sftp()
+        conn._dhc_dirs = set()
+    return sftp
+
+
+def cp(file: Path, dest: str, user: str = None, host: str = None, confirm: bool = False) -> None:
     """Copies a file to a remote host
 
     Parameters
@@ -97,26 +281,95 @@ def cp(file: Path, dest: str, user: str = None, host: str = None) -> None:
         The username to use for the remote host, by default ws4 from the settings
     host : str, optional
         The hostname of the remote host, by default ws4 from the settings
+    confirm : bool, optional
+        Whether to stat the file after the upload to verify its size, by default False
     """
-    assert file.is_file()
-    host = host or ENV["WORKER_HOST"]
-    user = user or ENV["WORKER_USER"]
-    SSH.connect(
-        host,
-        username=user,
-        key_filename=str(Path(ENV["PUBKEY"]).expanduser()),
-    )
-    sftp = SSH.open_sftp()
-    try:
-        sftp.stat("/tmp/classifynder_conf")
-    except:
-        sftp.mkdir("/tmp/classifynder_conf")
-    sftp.put(file, dest)
-    sftp.close()
-    SSH.close()
+    cp_many([(file, dest)], user, host, confirm)
 
 
-def execute(cmd: CMDType, user: str = None, host: str = None, progress: Callable = False, local: bool = False) -> str:
+def cp_many(files: List[Tuple[Path, str]], user: str = None, host: str = None, confirm: bool = False) -> None:
+    """Copies several files to a remote host over one SFTP channel
+
+    Parameters
+    ----------
+    files : List[Tuple[Path, str]]
+        The files to be copied, each with its destination path on the remote host (including the filename)
+    user : str, optional
+        The username to use for the remote host, by default ws4 from the settings
+    host : str, optional
+        The hostname of the remote host, by default ws4 from the settings
+    confirm : bool, optional
+        Whether to stat the files after the upload to verify their size, by default False
+    """
+    for file, _ in files:
+        assert file.is_file()
+    host = host or _DEFAULT_HOST
+    user = user or _DEFAULT_USER
+    with _checkout(user, host) as conn, conn._dhc_sftp_lock:
+        sftp = _get_sftp(conn)
+        # only probe the config folder once per connection
+        if "/tmp/classifynder_conf" not in conn._dhc_dirs:
+            try:
+                sftp.stat("/tmp/classifynder_conf")
+            except:
+                sftp.mkdir("/tmp/classifynder_conf")
+            conn._dhc_dirs.add("/tmp/classifynder_conf")
+        for file, dest in files:
+            sftp.put(file, dest, confirm=confirm)
+
+
+class _Progress:
+    """Collects the output of a command and reports it to a `progress` callback. The first output is reported right
+    away, later output at most every `interval` seconds. Readers call `poll` whenever they wake up, so held back output
+    is also reported while the command is quiet."""
+
+    interval = 0.1
+
+    def __init__(self, progress: Callable = False, delta: bool = False):
+        self.progress = progress
+        self.delta = delta
+        self.chunks = []
+        self.reported = 0
+        self.last_report = None
+
+    def add(self, chunk: str) -> None:
+        if chunk:
+            self.chunks.append(chunk)
+        self.poll()
+
+    def due_in(self) -> float:
+        """Seconds until the pending output is due to be reported, `interval` if there is none."""
+        if not self.progress or self.reported == len(self.chunks):
+            return self.interval
+        if self.last_report is None:
+            return 0.0
+        return max(0.0, self.last_report + self.interval - time.monotonic())
+
+    def poll(self) -> None:
+        if self.due_in() == 0.0:
+            self.report()
+
+    def report(self) -> None:
+        if not self.progress or self.reported == len(self.chunks):
+            return
+        self.progress("".join(self.chunks[self.reported :]) if self.delta else "".join(self.chunks))
+        self.reported = len(self.chunks)
+        self.last_report = time.monotonic()
+
+    def output(self) -> str:
+        self.report()
+        return "".join(self.chunks)
+
+
+def execute(
+    cmd: CMDType,
+    user: str = None,
+    host: str = None,
+    progress: Callable = False,
+    local: bool = False,
+    progress_delta: bool = False,
+    timeout: float = None,
+) -> str:
     """Executes a command on a remote host
 
     Parameters
@@ -128,36 +381,79 @@ def execute(cmd: CMDType, user: str = None, host: str = None, progress: Callable
     host : str, optional
         The hostname of the remote host, by default ws4 from the settings
     progress : Callable, optional
-        A function to be called with the stdout of the command as it is executed, by default False
+        A function to be called with the stdout of the command so far as it is executed, locally or remote. It is
+        called as soon as there is output, then at most every 100ms while there is new output and once at the end, by
+        default False
     local : bool, optional
         Whether to execute the command locally, by default False
+    progress_delta : bool, optional
+        Whether `progress` receives only the output since its previous call instead, by default False
+    timeout : float, optional
+        Seconds a remote command may go without output before `socket.timeout` is raised, by default None (wait forever)
     """
     if local:
         logger.info(f"Executing {cmd} on local machine")
-        stdout = ""
         with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True) as process:
-            for line in process.stdout:
-                stdout += line.decode("utf8")
-                if progress:
-                    progress(stdout)
-        return stdout
+            if not progress:
+                return process.stdout.read().decode("utf-8")
+
+            # read whatever is there instead of whole lines, and wake up when held back output is due
+            fd = process.stdout.fileno()
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            output = _Progress(progress, progress_delta)
+            while True:
+                readable, _, _ = select.select([fd], [], [], output.due_in())
+                if readable:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    output.add(decoder.decode(chunk))
+                else:
+                    output.poll()
+            output.add(decoder.decode(b"", final=True))
+            return output.output()
     else:
-        host = host or ENV["WORKER_HOST"]
-        user = user or ENV["WORKER_USER"]
+        host = host or _DEFAULT_HOST
+        user = user or _DEFAULT_USER
         if len(cmd) > 4000:
             logger.info(f'Executing long command {cmd[:500]}" on {user}@{host}')
         else:
             logger.info(f"Executing {cmd} on {user}@{host}")
-        SSH.connect(
-            host,
-            username=user,
-            key_filename=str(Path(ENV["PUBKEY"]).expanduser()),
-        )
         cmd = resolve_cmd(cmd)
-        _, stdout, _ = SSH.exec_command(cmd)
-        stdout = stdout.read().decode("utf-8")
-        SSH.close()
-        return stdout
+        with _checkout(user, host) as conn:
+            _, stdout, _ = conn.exec_command(cmd, timeout=timeout)
+            channel = stdout.channel
+            try:
+                if not progress:
+                    return stdout.read().decode("utf-8")
+
+                # stream the output as it arrives, so progress can be reported while the command runs
+                decoder = codecs.getincrementaldecoder("utf-8")()
+                output = _Progress(progress, progress_delta)
+                last_output = time.monotonic()
+                while not channel.exit_status_ready():
+                    select.select([channel], [], [], output.due_in())
+                    if channel.recv_ready():
+                        output.add(decoder.decode(channel.recv(65536)))
+                        last_output = time.monotonic()
+                    elif timeout is not None and time.monotonic() - last_output > timeout:
+                        raise socket.timeout(f"No output from {user}@{host} for {timeout}s")
+                    # report held back output even if the command went quiet
+                    output.poll()
+                # whatever is left after the command exited, recv returns b"" once the channel is drained
+                while True:
+                    chunk = channel.recv(65536)
+                    if not chunk:
+                        break
+                    output.add(decoder.decode(chunk))
+                output.add(decoder.decode(b"", final=True))
+                return output.output()
+            finally:
+                # also frees the remote session if the command timed out
+                channel.close()
+
+
+_TASK_ID_RE = re.compile(r"New task added \(id (\d+)\)")
 
 
 def queue(cmd: CMDType, task: str, user: str = None, host: str = None) -> int:
@@ -178,12 +474,32 @@ def queue(cmd: CMDType, task: str, user: str = None, host: str = None) -> int:
     if task not in available_tasks:
         raise ValueError(f"Task must be one of {available_tasks}")
 
-    cmd = resolve_cmd(cmd)
-    stdout = execute(f"./pueue add -g {task} -- {cmd}", user, host)
-    if "New task added" in stdout:
-        return int("".join(list(filter(lambda x: x in string.digits, stdout))))
-    else:
+    # the user's command is resolved and escaped exactly once here, execute passes the finished string through
+    stdout = execute(f"./pueue add -g {task} -- {resolve_cmd(cmd)}", user, host)
+    match = _TASK_ID_RE.search(stdout)
+    if match is None:
         raise RuntimeError("Couldn't queue the task")
+    return int(match.group(1))
+
+
+def kill(task_id: int, user: str = None, host: str = None) -> str:
+    """Kills a task queued with pueue
+
+    Parameters
+    ----------
+    task_id : int
+        The id of the task
+    user : str, optional
+        The username to use for the remote host, by default ws4 from the settings
+    host : str, optional
+        The hostname of the remote host, by default ws4 from the settings
+
+    Returns
+    -------
+    str
+        The output of pueue
+    """
+    return execute(f"./pueue kill {int(task_id)}", user, host)
 
 
 def simplify_pueue_status(status: Union[Dict[str, Any], str]) -> str:
@@ -206,8 +522,22 @@ def simplify_pueue_status(status: Union[Dict[str, Any], str]) -> str:
 time_parser = lambda x: datetime.datetime.fromisoformat(x.split("+")[0][:10]) if x else None
 
 
+def _project_status(logj: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "id": logj["task"]["id"],
+        "command": logj["task"]["command"],
+        "group": logj["task"]["group"],
+        "status": simplify_pueue_status(logj["task"]["status"]),
+        "started_at": time_parser(logj["task"]["start"]),
+        "ended_at": time_parser(logj["task"]["end"]),
+        "created_at": time_parser(logj["task"]["created_at"]),
+        "log": logj["output"],
+    }
+
+
 def status(task_id: int, full: bool = False, user: str = None, host: str = None) -> Dict[str, str]:
-    """Returns the status of a task.
+    """Returns the status of a task. To get the status of several tasks, use `statuses` instead of calling this in a
+    loop, it only needs a single pueue call.
 
     Parameters
     ----------
@@ -225,22 +555,51 @@ def status(task_id: int, full: bool = False, user: str = None, host: str = None)
     Dict[str, str]
         A dictionary with the status of the task. Contains, id, command, group, status, started_at, ended_at, created_at, log.
     """
-    task_id = str(task_id)
+    return statuses([task_id], full, user, host)[int(task_id)]
+
+
+def statuses(
+    task_ids: List[int], full: bool = False, user: str = None, host: str = None, timeout: float = None
+) -> Dict[int, Dict[str, str]]:
+    """Returns the status of several tasks with a single pueue call.
+
+    Parameters
+    ----------
+    task_ids : List[int]
+        The ids of the tasks
+    full : bool, optional
+        Whether to return the full logs, by default False
+    user : str, optional
+        The username to use for the remote host, by default ws4 from the settings
+    host : str, optional
+        The hostname of the remote host, by default ws4 from the settings
+    timeout : float, optional
+        Seconds to wait for pueue before `socket.timeout` is raised, by default None (wait forever)
+
+    Returns
+    -------
+    Dict[int, Dict[str, str]]
+        The status of each task as returned by `status`, keyed by the task id. Unknown tasks are missing.
+    """
     flags = " -f" if full else " -l 100"
-    logj = execute(f"./pueue log -j {task_id} {flags}", user, host)
-    logj = json.loads(logj)[task_id]
+    logj = execute(f"./pueue log -j {' '.join(str(int(task_id)) for task_id in task_ids)} {flags}", user, host, timeout=timeout)
+    return {int(task_id): _project_status(entry) for task_id, entry in _loads(logj).items()}
 
-    status_ = {
-        "id": logj["task"]["id"],
-        "command": logj["task"]["command"],
-        "group": logj["task"]["group"],
-        "status": simplify_pueue_status(logj["task"]["status"]),
-        "started_at": time_parser(logj["task"]["start"]),
-        "ended_at": time_parser(logj["task"]["end"]),
-        "created_at": time_parser(logj["task"]["created_at"]),
-        "log": logj["output"],
-    }
-    return status_
+
+def status_hash(status: Dict[str, Any]) -> str:
+    """Returns a fingerprint of a task status, to cheaply detect whether anything changed between two polls.
+
+    Parameters
+    ----------
+    status : Dict[str, Any]
+        A status dictionary as returned by `status`
+
+    Returns
+    -------
+    str
+        The hex digest of the status
+    """
+    return hashlib.sha1(json.dumps(status, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
 
 def start_notebook(name: str, parameters: Dict[str, Any] = None) -> str:
@@ -262,17 +621,15 @@ def start_notebook(name: str, parameters: Dict[str, Any] = None) -> str:
         parameters = {}
 
     name = name.replace(".ipynb", "").replace("template_", "")
-    template = f"{ENV['JUPYTER_TEMPLATE_FOLDER']}/template_{name}.ipynb"
+    template = f"{_JUPYTER_TEMPLATE_FOLDER}/template_{name}.ipynb"
     notebook_name = f"{name}_{datetime.datetime.now():%Y-%m-%d_%H-%M-%S-%f}.ipynb"
-    notebook = f"{ENV['JUPYTER_NOTEBOOK_FOLDER']}/generated/{notebook_name}"
-    parameters_encoded = base64.b64encode(yaml.dump(parameters).encode("utf-8")).decode("utf-8")
+    notebook = f"{_JUPYTER_NOTEBOOK_FOLDER}/generated/{notebook_name}"
+    parameters_encoded = base64.b64encode(yaml.dump(parameters, Dumper=_YAMLDumper).encode("utf-8")).decode("utf-8")
 
     logger.info(f"Starting Notebook {template} with {parameters}")
     stdout = execute(
         f"/home/task_runner/miniforge3/envs/hbdx/bin/papermill --prepare-only {template} {notebook} -b {parameters_encoded}",
-        user=ENV["JUPYTER_USER"],
-        host=ENV["JUPYTER_HOST"],
-    )
-    return (
-        f"http://{ENV['JUPYTER_HOST']}:{ENV['JUPYTER_PORT']}/notebooks/generated/{notebook_name}?kernel_name={ENV['JUPYTER_KERNEL_NAME']}"
+        user=_JUPYTER_USER,
+        host=_JUPYTER_HOST,
     )
+    return _JUPYTER_NOTEBOOK_URL.format(notebook_name)
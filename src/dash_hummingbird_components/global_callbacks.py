@@ -20,26 +20,22 @@ def url_parameter(*input_params):
 
 
 def make_url_params_callback():
+    # the registry is complete once the callback is made, map the callback keys to the params once
+    key_to_param = {f"param{i}": param for i, param in enumerate(_url_param_registry)}
+    quote_plus = urllib.parse.quote_plus
+
     def update_url(**values):
-        if not values or len(values) == 0:
+        if not values:
             return no_update
-        logger.debug(f"update_url({values}")
-
-        search = []
-        for idx, value in values.items():
-            if value is None or value == "":
-                continue
-            idx = int(idx.replace("param", ""))
-            # encode value for url using urllib.parse.quote_plus
-            # https://docs.python.org/3/library/urllib.parse.html#urllib.parse.quote_plus
-            #if value not an str then convert to str
-            if not isinstance(value, str):
-                value = str(value)
-
-            value = urllib.parse.quote_plus(value)
-
-            search.append(f"{_url_param_registry[idx]}={value}")
-        return "?" + "&".join(search)
+        logger.debug("update_url(%s)", values)
+
+        # encode value for url using urllib.parse.quote_plus
+        # https://docs.python.org/3/library/urllib.parse.html#urllib.parse.quote_plus
+        return "?" + "&".join(
+            f"{key_to_param[key]}={quote_plus(value if isinstance(value, str) else str(value))}"
+            for key, value in values.items()
+            if value is not None and value != ""
+        )
 
     inputs = {f"param{i}": Input(id_, "value") for i, id_ in enumerate(_url_inputs_registry)}
     logger.debug(f"URL parameter relationships: {inputs}")
@@ -68,11 +68,13 @@ def options_output(listable: List[str], all: bool = False, value: str = None) ->
     Tuple[str, Dict[str, str]]
         The outputs for the value and the options
     """
+    # `all` shadows the builtin here, so check the items with any instead
+    already_str = not any(not isinstance(item, str) for item in listable)
     if len(listable) == 0:
         value = None
     elif value is None:
         if all is True:
-            value = list(map(str, listable))
+            value = list(listable) if already_str else list(map(str, listable))
         else:
             value = str(listable[0])
     else:
@@ -82,7 +84,7 @@ def options_output(listable: List[str], all: bool = False, value: str = None) ->
             value = str(value)
             if value not in listable:
                 value = str(listable[0])
-    return value, list_to_label_dict(listable)
+    return value, list_to_label_dict(listable, _already_str=already_str)
 
 
 def TableOutput(name: str) -> Tuple[Output, Output]:
@@ -170,9 +172,12 @@ def table_output(
     if not isinstance(df, pd.DataFrame):
         return df
 
+    # shallow copy, the columns are renamed and replaced below without touching the caller's frame
+    df = df.copy(deep=False)
     if round:
-        float_df = df.select_dtypes(float).round(precision)
-        df[float_df.columns] = float_df
+        # assign column by column, so each one is replaced instead of written into the shared data
+        for column in df.select_dtypes(float).columns:
+            df[column] = df[column].round(precision)
 
     levels = df.columns.nlevels
     columns = []
@@ -184,11 +189,13 @@ def table_output(
             columns = list_to_id_dict(df.columns, hideable=hideable)
             data = df.to_dict("records")
     else:
-        ids = ["".join([col for col in multi_col if col]) for multi_col in list(df.columns)]
+        ids = ["".join(filter(None, multi_col)) for multi_col in df.columns]
         # build columns list from ids and columns of the dataframe
-        columns = [{"name": list(col), "id": id_} for col, id_ in zip(list(df.columns), ids)]
-        # build data list from ids and rows of the dataframe
-        data = [{k: v for k, v in zip(ids, row)} for row in df.values]
+        columns = [{"name": list(multi_col), "id": id_} for multi_col, id_ in zip(df.columns, ids)]
+        # build data list from ids and rows of the dataframe, the multi-index columns are still needed for coloring
+        records = df.copy(deep=False)
+        records.columns = ids
+        data = records.to_dict("records")
 
     if markdown is not None:
         markdown = [c.replace("_", " ") for c in markdown]
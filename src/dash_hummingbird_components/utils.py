@@ -1,10 +1,12 @@
 from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 from natsort import natsorted
 import logging
 from typing import Dict, List, Tuple
 
 import colorlover
+import numpy as np
 import pandas as pd
 
 __all__ = ["list_to_id_dict", "list_to_label_dict", "discrete_background_color_bins", "load_datasets"]
@@ -33,13 +35,15 @@ def list_to_id_dict(listable: List[str], **kwargs) -> List[Dict[str, str]]:
     return [{"name": k, "id": k, **kwargs} for k in listable]
 
 
-def list_to_label_dict(listable: List[str], **kwargs) -> List[Dict[str, str]]:
+def list_to_label_dict(listable: List[str], _already_str: bool = False, **kwargs) -> List[Dict[str, str]]:
     """Generates a dash compliant label dictionary from a list of strings.
 
     Parameters
     ----------
     listable : List[str]
         The strings/labels/names
+    _already_str : bool, optional
+        Whether all items are known to be strings already, which skips converting them, by default False
 
     Returns
     -------
@@ -49,9 +53,23 @@ def list_to_label_dict(listable: List[str], **kwargs) -> List[Dict[str, str]]:
         {"label": "soemthing", "value": "somthing"}
         ```
     """
+    if _already_str:
+        return [{"label": k, "value": k, **kwargs} for k in listable]
     return [{"label": str(k), "value": str(k), **kwargs} for k in listable]
 
 
+@lru_cache(maxsize=16)
+def _palette_and_bounds(n_bins: int) -> Tuple[Tuple[float, ...], Tuple[Tuple[str, str, bool], ...]]:
+    # everything about the bins that only depends on their number: the relative bounds and per bin the background
+    # color, the text color and whether it has an upper bound
+    bounds = tuple(i * (1.0 / n_bins) for i in range(n_bins + 1))
+    colors = colorlover.scales[str(n_bins)]["seq"]["Blues"]
+    palette = tuple(
+        (colors[i - 1], "white" if i > len(bounds) / 2.0 else "inherit", i < len(bounds) - 1) for i in range(1, len(bounds))
+    )
+    return bounds, palette
+
+
 def discrete_background_color_bins(df: pd.DataFrame, n_bins: int = 5, lim: Tuple[float] = None) -> List[Dict]:
     """Generates a color-grading background for this DataFrame. Note that the colormap is not per column but for
     all the columns in the DataFrame.
@@ -76,34 +94,35 @@ def discrete_background_color_bins(df: pd.DataFrame, n_bins: int = 5, lim: Tuple
     List[Dict]
         The style queries as mandated by DASH.
     """
-    bounds = [i * (1.0 / n_bins) for i in range(n_bins + 1)]
+    bounds, palette = _palette_and_bounds(n_bins)
     c_max, c_min = (None, None) if lim is None or lim is False else lim
-    if c_max is None:
-        c_max = df.max(numeric_only=True).max()
-    if c_min is None:
-        c_min = df.min(numeric_only=True).min()
+    if c_max is None or c_min is None:
+        # one float array of the numeric data for both reductions, fmin/fmax skip NaNs without warning
+        values = df.select_dtypes(["number", "bool"]).to_numpy(dtype=float, na_value=np.nan)
+        if c_max is None:
+            c_max = np.fmax.reduce(values, axis=None) if values.size else np.nan
+        if c_min is None:
+            c_min = np.fmin.reduce(values, axis=None) if values.size else np.nan
     ranges = [((c_max - c_min) * i) + c_min for i in bounds]
-    styles = []
-    for i in range(1, len(bounds)):
-        min_bound = ranges[i - 1]
-        max_bound = ranges[i]
-        backgroundColor = colorlover.scales[str(n_bins)]["seq"]["Blues"][i - 1]
-        color = "white" if i > len(bounds) / 2.0 else "inherit"
-
-        for column in df:
-            styles.append(
-                {
-                    "if": {
-                        "filter_query": (
-                            "{{{column}}} >= {min_bound}" + (" && {{{column}}} < {max_bound}" if (i < len(bounds) - 1) else "")
-                        ).format(column=column, min_bound=min_bound, max_bound=max_bound),
-                        "column_id": column,
-                    },
-                    "backgroundColor": backgroundColor,
-                    "color": color,
-                }
-            )
-    return styles
+
+    # the per bin and per column parts of the queries, so building the styles is only concatenation
+    bins = [
+        (ranges[i], ranges[i + 1], not_last, backgroundColor, color)
+        for i, (backgroundColor, color, not_last) in enumerate(palette)
+    ]
+    columns = [(column, f"{{{column}}}") for column in df]
+    return [
+        {
+            "if": {
+                "filter_query": f"{token} >= {min_bound}" + (f" && {token} < {max_bound}" if not_last else ""),
+                "column_id": column,
+            },
+            "backgroundColor": backgroundColor,
+            "color": color,
+        }
+        for min_bound, max_bound, not_last, backgroundColor, color in bins
+        for column, token in columns
+    ]
 
 
 def load_datasets(folder: Path) -> Dict[str, List[str]]: